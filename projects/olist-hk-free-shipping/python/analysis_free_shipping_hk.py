@@ -14,11 +14,15 @@ python analysis_free_shipping_hk.py \
 from __future__ import annotations
 
 import argparse
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from scipy import stats
+import pyarrow as pa
+from pyarrow import csv as pacsv
+from scipy import special
 from sqlalchemy import create_engine, text
 
 
@@ -33,6 +37,12 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--password", required=True)
     parser.add_argument("--database", default="olist_portfolio")
     parser.add_argument("--outdir", default="../outputs")
+    parser.add_argument(
+        "--driver",
+        choices=["pymysql", "connectorx"],
+        default="pymysql",
+        help="connectorx decodes MySQL results straight into Arrow (pip install connectorx)",
+    )
     return parser.parse_args()
 
 
@@ -43,73 +53,141 @@ def build_engine(args: argparse.Namespace):
     return create_engine(conn_str)
 
 
+def build_reader(args: argparse.Namespace) -> Callable[[str], pd.DataFrame]:
+    if args.driver == "connectorx":
+        import connectorx as cx
+
+        conn_str = f"mysql://{args.user}:{args.password}@{args.host}:{args.port}/{args.database}"
+
+        def read_connectorx(sql: str) -> pd.DataFrame:
+            table = cx.read_sql(conn_str, sql, return_type="arrow")
+            # Match the pymysql path, where read_sql coerces DECIMAL values to floats.
+            schema = pa.schema(
+                [
+                    pa.field(field.name, pa.float64()) if pa.types.is_decimal(field.type) else field
+                    for field in table.schema
+                ]
+            )
+            return table.cast(schema).to_pandas(types_mapper=pd.ArrowDtype)
+
+        return read_connectorx
+
+    engine = build_engine(args)
+
+    def read_sqlalchemy(sql: str) -> pd.DataFrame:
+        return pd.read_sql(text(sql), engine, dtype_backend="pyarrow")
+
+    return read_sqlalchemy
+
+
 # ------------------------------
 # Data extraction (SQL -> Pandas)
 # ------------------------------
-def fetch_dataframes(engine):
-    monthly = pd.read_sql(
-        text(
-            """
-            SELECT *
-            FROM marts.agg_monthly_kpi
-            ORDER BY order_month
-            """
-        ),
-        engine,
+def fetch_dataframes(read_sql: Callable[[str], pd.DataFrame]):
+    monthly = read_sql(
+        """
+        SELECT
+            order_month,
+            orders,
+            gmv,
+            freight_total,
+            avg_freight_per_order,
+            avg_delivery_days,
+            avg_delivery_delay_days,
+            avg_distance_km,
+            avg_freight_ratio,
+            avg_review_score,
+            free_shipping_order_rate,
+            policy_sim_apply_rate
+        FROM marts.agg_monthly_kpi
+        ORDER BY order_month
+        """
     )
 
-    corr_input = pd.read_sql(
-        text(
-            """
-            SELECT *
-            FROM analytics.v_monthly_corr_input
-            ORDER BY order_month
-            """
-        ),
-        engine,
+    corr_input = read_sql(
+        """
+        SELECT
+            order_month,
+            order_count,
+            avg_freight_per_order,
+            avg_delivery_days,
+            avg_distance_km,
+            avg_review_score,
+            free_shipping_order_rate,
+            policy_sim_apply_rate
+        FROM analytics.v_monthly_corr_input
+        ORDER BY order_month
+        """
     )
 
-    order_review = pd.read_sql(
-        text(
-            """
-            SELECT
-                order_id,
-                order_month,
-                order_gmv,
-                order_freight,
-                is_free_shipping_order,
-                policy_sim_free_ship_flag,
-                avg_delivery_days,
-                avg_distance_km,
-                review_score
-            FROM marts.order_review_metrics
-            """
-        ),
-        engine,
+    # One server-side scan cross-tabulates both shipping flags; each segment summary and
+    # the review-score t-test are rebuilt from these cells, so only a handful of rows
+    # reach pandas.
+    segment_cells = read_sql(
+        """
+        SELECT
+            is_free_shipping_order,
+            policy_sim_free_ship_flag,
+            COUNT(*) AS orders,
+            SUM(order_gmv) AS gmv_sum,
+            COUNT(order_gmv) AS gmv_n,
+            SUM(order_freight) AS freight_sum,
+            COUNT(order_freight) AS freight_n,
+            SUM(avg_delivery_days) AS delivery_days_sum,
+            COUNT(avg_delivery_days) AS delivery_days_n,
+            SUM(review_score) AS review_sum,
+            VAR_POP(review_score) * COUNT(review_score) AS review_m2,
+            COUNT(review_score) AS review_n
+        FROM marts.order_review_metrics
+        GROUP BY is_free_shipping_order, policy_sim_free_ship_flag
+        """
     )
 
-    seller_monthly = pd.read_sql(
-        text(
-            """
-            SELECT *
+    # Only sellers with at least one campaign-like month can produce an uplift row.
+    seller_monthly = read_sql(
+        """
+        WITH cand AS (
+            SELECT DISTINCT seller_id
             FROM marts.agg_seller_monthly_kpi
-            """
-        ),
-        engine,
+            WHERE free_shipping_item_rate >= 0.8
+              AND orders >= 30
+        )
+        SELECT
+            sm.seller_id,
+            sm.order_month,
+            sm.free_shipping_item_rate,
+            sm.orders,
+            sm.gmv
+        FROM marts.agg_seller_monthly_kpi sm
+        JOIN cand
+          ON sm.seller_id = cand.seller_id
+        """
     )
-
-    policy_sim = pd.read_sql(
-        text(
-            """
-            SELECT *
-            FROM analytics.sim_policy_monthly
-            ORDER BY order_month
-            """
-        ),
-        engine,
+    # Hash the string keys once; downstream grouping and key lookups work on integer codes.
+    seller_monthly = seller_monthly.astype({"seller_id": "category", "order_month": "category"})
+
+    policy_sim = read_sql(
+        """
+        SELECT
+            order_month,
+            orders,
+            gmv,
+            subsidy_cost_estimate,
+            avg_subsidy_if_applied,
+            avg_weight_if_applied,
+            apply_rate
+        FROM analytics.sim_policy_monthly
+        ORDER BY order_month
+        """
     )
 
-    return monthly, corr_input, order_review, seller_monthly, policy_sim
+    return (
+        monthly,
+        corr_input,
+        segment_cells,
+        seller_monthly,
+        policy_sim,
+    )
 
 
 # ------------------------------
@@ -123,133 +201,158 @@ def correlation_analysis(corr_input: pd.DataFrame) -> pd.DataFrame:
         "avg_freight_per_order",
         "free_shipping_order_rate",
     ]
-    return corr_input[cols].corr(method="pearson")
-
-
-def uplift_analysis(order_review: pd.DataFrame) -> pd.DataFrame:
-    summary = (
-        order_review.groupby("is_free_shipping_order", dropna=False)
-        .agg(
-            orders=("order_id", "nunique"),
-            avg_gmv=("order_gmv", "mean"),
-            avg_freight=("order_freight", "mean"),
-            avg_delivery_days=("avg_delivery_days", "mean"),
-            avg_review=("review_score", "mean"),
-        )
-        .reset_index()
-    )
-    summary["segment"] = np.where(
-        summary["is_free_shipping_order"] == 1,
-        "FreeShipping",
-        "PaidShipping",
+    # Pearson matrix via one np.corrcoef call on a dense float64 block (complete rows only).
+    values = corr_input[cols].to_numpy(dtype=np.float64, na_value=np.nan)
+    values = values[~np.isnan(values).any(axis=1)]
+    return pd.DataFrame(np.corrcoef(values, rowvar=False), index=cols, columns=cols)
+
+
+def summarize_segment_cells(segment_cells: pd.DataFrame, flag_col: str) -> pd.DataFrame:
+    totals = segment_cells.groupby(flag_col).sum(numeric_only=True)
+    sums = totals.astype(np.float64)
+    return pd.DataFrame(
+        {
+            "orders": totals["orders"],
+            "avg_gmv": sums["gmv_sum"] / sums["gmv_n"],
+            "avg_freight": sums["freight_sum"] / sums["freight_n"],
+            "avg_delivery_days": sums["delivery_days_sum"] / sums["delivery_days_n"],
+            "avg_review": sums["review_sum"] / sums["review_n"],
+        }
+    ).reset_index()
+
+
+def uplift_analysis(segment_cells: pd.DataFrame) -> pd.DataFrame:
+    summary = summarize_segment_cells(segment_cells, "is_free_shipping_order")
+    summary["segment"] = pd.Categorical.from_codes(
+        summary["is_free_shipping_order"].fillna(0).astype("int8"),
+        categories=["PaidShipping", "FreeShipping"],
     )
     return summary
 
 
-def simulation_uplift_analysis(order_review: pd.DataFrame) -> pd.DataFrame:
-    summary = (
-        order_review.groupby("policy_sim_free_ship_flag", dropna=False)
-        .agg(
-            orders=("order_id", "nunique"),
-            avg_gmv=("order_gmv", "mean"),
-            avg_freight=("order_freight", "mean"),
-            avg_delivery_days=("avg_delivery_days", "mean"),
-            avg_review=("review_score", "mean"),
-        )
-        .reset_index()
-    )
-    summary["segment"] = np.where(
-        summary["policy_sim_free_ship_flag"] == 1,
-        "Policy_Eligible",
-        "Policy_NotEligible",
+def simulation_uplift_analysis(segment_cells: pd.DataFrame) -> pd.DataFrame:
+    summary = summarize_segment_cells(segment_cells, "policy_sim_free_ship_flag")
+    summary["segment"] = pd.Categorical.from_codes(
+        summary["policy_sim_free_ship_flag"].fillna(0).astype("int8"),
+        categories=["Policy_NotEligible", "Policy_Eligible"],
     )
     return summary
 
 
-def ttest_analysis(order_review: pd.DataFrame) -> pd.DataFrame:
-    free = order_review.loc[
-        (order_review["is_free_shipping_order"] == 1)
-        & (order_review["review_score"].notna()),
-        "review_score",
-    ]
-    paid = order_review.loc[
-        (order_review["is_free_shipping_order"] == 0)
-        & (order_review["review_score"].notna()),
-        "review_score",
-    ]
-
-    t_stat, p_val = stats.ttest_ind(free, paid, equal_var=False, nan_policy="omit")
+def welch_t_test(
+    n_a: float, mean_a: float, var_a: float, n_b: float, mean_b: float, var_b: float
+) -> tuple[float, float]:
+    # Welch's unequal-variance t-test from group moments; the two-sided p-value comes straight
+    # from the Student t CDF (scipy.special.stdtr) without scipy.stats dispatch.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se2_a = var_a / n_a
+        se2_b = var_b / n_b
+        t_stat = (mean_a - mean_b) / np.sqrt(se2_a + se2_b)
+        dof = (se2_a + se2_b) ** 2 / (se2_a**2 / (n_a - 1) + se2_b**2 / (n_b - 1))
+    p_val = 2 * special.stdtr(dof, -np.abs(t_stat))
+    return t_stat, p_val
+
+
+def ttest_analysis(segment_cells: pd.DataFrame) -> pd.DataFrame:
+    # Review-score moments per shipping group, merged from the per-cell count, sum and sum of
+    # squared deviations (M2) with Chan's parallel-variance update.
+    cells = segment_cells[["review_n", "review_sum", "review_m2"]].astype(np.float64).fillna(0.0)
+    flag = segment_cells["is_free_shipping_order"]
+    totals = cells.groupby(flag).sum().reindex([1, 0], fill_value=0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        group_mean = totals["review_sum"] / totals["review_n"]
+        cell_mean = cells["review_sum"] / cells["review_n"]
+        between = (cells["review_n"] * (cell_mean - flag.map(group_mean)) ** 2).groupby(flag).sum()
+        m2 = totals["review_m2"] + between.reindex(totals.index, fill_value=0.0)
+        var = (m2 / (totals["review_n"] - 1)).to_numpy()
+
+    n = totals["review_n"].to_numpy()
+    mean = group_mean.to_numpy()
+    t_stat, p_val = welch_t_test(n[0], mean[0], var[0], n[1], mean[1], var[1])
 
     return pd.DataFrame(
         {
             "metric": ["review_score"],
             "group_a": ["FreeShipping"],
             "group_b": ["PaidShipping"],
-            "mean_a": [free.mean()],
-            "mean_b": [paid.mean()],
+            "mean_a": [mean[0]],
+            "mean_b": [mean[1]],
             "t_stat": [t_stat],
             "p_value": [p_val],
-            "n_a": [free.shape[0]],
-            "n_b": [paid.shape[0]],
+            "n_a": [int(n[0])],
+            "n_b": [int(n[1])],
         }
     )
 
 
 def detect_campaign_sellers(seller_monthly: pd.DataFrame) -> pd.DataFrame:
-    df = seller_monthly.copy()
+    # Read-only view of the input: the campaign flag is kept as a separate mask, not a column.
+    df = seller_monthly
     candidate = df[(df["free_shipping_item_rate"] >= 0.8) & (df["orders"] >= 30)]
 
-    if candidate.empty:
-        return pd.DataFrame(
-            columns=[
-                "seller_id",
-                "campaign_months",
-                "avg_orders_campaign",
-                "avg_orders_non_campaign",
-                "order_uplift_pct",
-                "avg_gmv_campaign",
-                "avg_gmv_non_campaign",
-                "gmv_uplift_pct",
-            ]
-        )
-
-    campaign_keys = set(zip(candidate["seller_id"], candidate["order_month"]))
-
-    df["is_campaign_month"] = df.apply(
-        lambda x: (x["seller_id"], x["order_month"]) in campaign_keys,
-        axis=1,
+    # Hash each (seller_id, order_month) pair to one uint64 and probe with np.isin,
+    # avoiding per-row tuple objects on both the build and the lookup side.
+    key_cols = ["seller_id", "order_month"]
+    campaign_keys = pd.util.hash_pandas_object(candidate[key_cols], index=False).to_numpy()
+    all_keys = pd.util.hash_pandas_object(df[key_cols], index=False).to_numpy()
+    is_campaign = np.isin(all_keys, campaign_keys)
+
+    # Accumulate per-seller sums and counts in one bincount pass over integer codes.
+    # Slot 2*code holds non-campaign months and slot 2*code+1 campaign months.
+    codes, sellers = pd.factorize(df["seller_id"], sort=True)
+    slots = codes * 2 + is_campaign
+    n_slots = 2 * len(sellers)
+
+    counts = np.bincount(slots, minlength=n_slots).reshape(-1, 2)
+    order_sums = np.bincount(
+        slots, weights=df["orders"].to_numpy(dtype=np.float64), minlength=n_slots
+    ).reshape(-1, 2)
+    gmv_sums = np.bincount(
+        slots, weights=df["gmv"].to_numpy(dtype=np.float64), minlength=n_slots
+    ).reshape(-1, 2)
+
+    # Sellers without both campaign and non-campaign months drop out. The result is always
+    # built from these typed arrays, so an empty result keeps the same column dtypes.
+    eligible = (counts > 0).all(axis=1)
+
+    counts = counts[eligible]
+    avg_orders = order_sums[eligible] / counts
+    avg_gmv = gmv_sums[eligible] / counts
+    avg_orders_non, avg_orders_campaign = avg_orders[:, 0], avg_orders[:, 1]
+    avg_gmv_non, avg_gmv_campaign = avg_gmv[:, 0], avg_gmv[:, 1]
+    seller_ids = sellers[eligible]
+
+    campaign_months = (
+        df.loc[is_campaign]
+        .groupby("seller_id", observed=True)["order_month"]
+        .agg(lambda s: ", ".join(sorted(s.astype(str).unique())))
     )
 
-    rows = []
-    for seller, part in df.groupby("seller_id"):
-        camp = part[part["is_campaign_month"]]
-        non = part[~part["is_campaign_month"]]
-        if camp.empty or non.empty:
-            continue
-
-        avg_orders_campaign = camp["orders"].mean()
-        avg_orders_non = non["orders"].mean()
-        avg_gmv_campaign = camp["gmv"].mean()
-        avg_gmv_non = non["gmv"].mean()
-
-        rows.append(
-            {
-                "seller_id": seller,
-                "campaign_months": ", ".join(sorted(camp["order_month"].astype(str).unique())),
-                "avg_orders_campaign": avg_orders_campaign,
-                "avg_orders_non_campaign": avg_orders_non,
-                "order_uplift_pct": ((avg_orders_campaign - avg_orders_non) / avg_orders_non) * 100
-                if avg_orders_non > 0
-                else np.nan,
-                "avg_gmv_campaign": avg_gmv_campaign,
-                "avg_gmv_non_campaign": avg_gmv_non,
-                "gmv_uplift_pct": ((avg_gmv_campaign - avg_gmv_non) / avg_gmv_non) * 100
-                if avg_gmv_non > 0
-                else np.nan,
-            }
+    with np.errstate(divide="ignore", invalid="ignore"):
+        order_uplift_pct = np.where(
+            avg_orders_non > 0,
+            (avg_orders_campaign - avg_orders_non) / avg_orders_non * 100,
+            np.nan,
+        )
+        gmv_uplift_pct = np.where(
+            avg_gmv_non > 0,
+            (avg_gmv_campaign - avg_gmv_non) / avg_gmv_non * 100,
+            np.nan,
         )
 
-    return pd.DataFrame(rows).sort_values("gmv_uplift_pct", ascending=False)
+    result = pd.DataFrame(
+        {
+            "seller_id": seller_ids,
+            "campaign_months": campaign_months.reindex(seller_ids).to_numpy(),
+            "avg_orders_campaign": avg_orders_campaign,
+            "avg_orders_non_campaign": avg_orders_non,
+            "order_uplift_pct": order_uplift_pct,
+            "avg_gmv_campaign": avg_gmv_campaign,
+            "avg_gmv_non_campaign": avg_gmv_non,
+            "gmv_uplift_pct": gmv_uplift_pct,
+        }
+    )
+    return result.sort_values("gmv_uplift_pct", ascending=False)
 
 
 def build_recommendation_text(
@@ -302,6 +405,15 @@ Action:
     return recommendation
 
 
+# ------------------------------
+# Output helpers
+# ------------------------------
+def write_csv(df: pd.DataFrame, path: Path, index: bool = False) -> None:
+    if index:
+        df = df.reset_index(names="")
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
+
+
 # ------------------------------
 # Main execution
 # ------------------------------
@@ -310,14 +422,20 @@ def main() -> None:
     outdir = Path(args.outdir)
     outdir.mkdir(parents=True, exist_ok=True)
 
-    engine = build_engine(args)
+    read_sql = build_reader(args)
 
-    monthly, corr_input, order_review, seller_monthly, policy_sim = fetch_dataframes(engine)
+    (
+        monthly,
+        corr_input,
+        segment_cells,
+        seller_monthly,
+        policy_sim,
+    ) = fetch_dataframes(read_sql)
 
     corr_df = correlation_analysis(corr_input)
-    uplift_df = uplift_analysis(order_review)
-    sim_uplift_df = simulation_uplift_analysis(order_review)
-    ttest_df = ttest_analysis(order_review)
+    uplift_df = uplift_analysis(segment_cells)
+    sim_uplift_df = simulation_uplift_analysis(segment_cells)
+    ttest_df = ttest_analysis(segment_cells)
     seller_uplift_df = detect_campaign_sellers(seller_monthly)
 
     recommendation = build_recommendation_text(
@@ -328,14 +446,23 @@ def main() -> None:
         policy_sim,
     )
 
-    monthly.to_csv(outdir / "monthly_kpi.csv", index=False)
-    corr_input.to_csv(outdir / "monthly_corr_input.csv", index=False)
-    corr_df.to_csv(outdir / "correlation_matrix.csv")
-    uplift_df.to_csv(outdir / "shipping_segment_uplift.csv", index=False)
-    sim_uplift_df.to_csv(outdir / "policy_eligibility_uplift.csv", index=False)
-    ttest_df.to_csv(outdir / "ttest_review_score.csv", index=False)
-    seller_uplift_df.to_csv(outdir / "seller_campaign_uplift.csv", index=False)
-    policy_sim.to_csv(outdir / "policy_monthly_simulation.csv", index=False)
+    outputs = [
+        (monthly, "monthly_kpi.csv", False),
+        (corr_input, "monthly_corr_input.csv", False),
+        (corr_df, "correlation_matrix.csv", True),
+        (uplift_df, "shipping_segment_uplift.csv", False),
+        (sim_uplift_df, "policy_eligibility_uplift.csv", False),
+        (ttest_df, "ttest_review_score.csv", False),
+        (seller_uplift_df, "seller_campaign_uplift.csv", False),
+        (policy_sim, "policy_monthly_simulation.csv", False),
+    ]
+    # Arrow releases the GIL while writing, so the files can be written concurrently.
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(write_csv, df, outdir / name, index) for df, name, index in outputs
+        ]
+        for future in futures:
+            future.result()
 
     (outdir / "recommendation.txt").write_text(recommendation, encoding="utf-8")
 
@@ -213,6 +213,7 @@ LEFT JOIN (
 ) rv
   ON olm.order_id = rv.order_id;
 ALTER TABLE marts.order_review_metrics
+  ADD PRIMARY KEY (order_id),
   ADD KEY idx_orm_month (order_month),
   ADD KEY idx_orm_review (review_score);
 /*